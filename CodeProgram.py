@@ -1,11 +1,15 @@
 # coding: utf-8
 import os
-import json
+import shutil
+import orjson
 import subprocess
 import time
+import threading
 import openai
-import statistics
-import math
+import httpx
+import operator
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple, Optional
 
 # Конфігурація
@@ -13,6 +17,12 @@ OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = "gpt-3.5-turbo"
 CPP_COMPILER = "g++"
 CPP_OUTPUT_EXECUTABLE_NAME = "gps_algorithm" # Ім'я вихідного виконуваного файлу
+# Прапорці, спільні для передкомпільованого заголовка та основної компіляції: "-O2" компілюється швидше за "-O3",
+# а "-march=native" та послаблені правила для чисел з плаваючою комою дозволяють векторизувати тригонометрію у формулі Гаверсина
+CPP_FLAGS = ["-std=c++17", "-O2", "-march=native", "-funsafe-math-optimizations", "-fno-math-errno",
+             "-fno-trapping-math", "-ffp-contract=fast"]
+CPP_PCH_HEADER = "pch.h" # Передкомпільований заголовок з важкими залежностями (створюється в OUTPUT_DIR)
+CPP_PCH_INCLUDES = ["nlohmann/json.hpp", "vector", "cmath"]
 
 TEST_FILES = ["points.json", "points2.json", "points3.json"] # Список файлів з тестовімі даними
 
@@ -20,37 +30,104 @@ MAX_ITERATIONS = 15 # Максимальна кількість ітерацій
 SUCCESS_ITERATIONS_TARGET = 15 # Цільова кількість успішних ітерацій
 
 OUTPUT_DIR = "results" # Директорія для результатів
+ITERATIONS_LOG_FILE = "iterations.jsonl" # Підсумки ітерацій, що дописуються по мірі виконання (JSON Lines)
+
+API_REQUESTS_PER_MINUTE = 30 # Ліміт запитів до OpenAI API (не частіше одного запиту на 2 секунди)
 
 # Параметри валідації
 ANOMALY_SPEED_THRESHOLD_M_PER_S = 200.0 # Поріг аномальної швидкості (м/с)
 SPEED_DEVIATION_TOLERANCE_PERCENT = 35 # Допустиме відхилення швидкості (%)
 
+class RateLimiter:
+    """Token bucket для обмеження частоти запитів до API (безпечний для потоків)."""
+    def __init__(self, requests_per_minute: float, capacity: int = 1):
+        self.interval = 60.0 / requests_per_minute # Час поповнення одного токена (сек)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Чекає, поки з'явиться вільний токен, і забирає його."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) / self.interval)
+            self.last_refill = now
+
+            if self.tokens < 1:
+                time.sleep((1 - self.tokens) * self.interval)
+                self.tokens = 1.0
+                self.last_refill = time.monotonic()
+            self.tokens -= 1
+
+def _write_bytes_atomic(path: str, data: bytes):
+    """Атомарно записує байти у файл: читач бачить або старий, або повністю записаний новий вміст."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _numeric_column(points: List[Dict], key: str) -> np.ndarray:
+    """Збирає значення ключа з усіх точок у масив float64, відхиляючи нечислові (None, рядки) та нескінченні значення."""
+    values = np.array([p[key] for p in points])
+    if values.ndim != 1 or values.dtype.kind not in "iuf":
+        raise TypeError(f"нечислові значення '{key}' у виправлених точках")
+    values = values.astype(np.float64)
+    if not np.isfinite(values).all():
+        raise ValueError(f"некоректні (NaN/нескінченні) значення '{key}' у виправлених точках")
+    return values
+
 class GPSDataProcessor:
     def __init__(self):
         self.iteration_results = []
         os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-        # Ініціалізація клієнта OpenAI
-        self.client = openai.OpenAI(api_key=OPENAI_KEY, timeout=30.0,)
-        self.cpp_code_history = {} # Для збереження коду найкращих ітерацій
+        # Ініціалізація клієнта OpenAI зі спільним HTTP/2 з'єднанням, що повторно використовується між ітераціями
+        self.http_client = httpx.Client(
+            # Ліміти задаються транспорту: httpx.Client ігнорує limits=, якщо передано власний transport
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=3,
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2, keepalive_expiry=120.0),
+            ),
+            timeout=30.0,
+        )
+        self.client = openai.OpenAI(api_key=OPENAI_KEY, timeout=30.0, http_client=self.http_client)
+        try:
+            # Попереднє встановлення TLS з'єднання, щоб перша ітерація не витрачала на це час
+            self.client.models.list()
+        except openai.APIError as e:
+            print(f"Не вдалося попередньо під'єднатися до OpenAI API: {e}")
+        self.rate_limiter = RateLimiter(API_REQUESTS_PER_MINUTE) # Замість фіксованої затримки між ітераціями
+        self._file_cache: Dict[str, Tuple[List[Dict], str]] = {} # Тестовий файл -> (завантажені дані, шлях до вхідного файлу для C++)
+        self._pch_header: Optional[str] = None # Шлях до передкомпільованого заголовка (None - ще не створено або недоступний)
+        self._pch_attempted = False
+        self.ccache = shutil.which("ccache") # Кешування компіляції, якщо ccache встановлено
+
+        # Найшвидший код, що пройшов усі тести, використовується як приклад (few-shot) для наступних генерацій
+        self._best_successful_code: Optional[str] = None
+        self._best_successful_time = float('inf')
 
     def load_json_data(self, json_path: str) -> List[Dict]:
         """Завантажує JSON дані з файлу."""
         try:
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(json_path, 'rb') as f:
+                data = orjson.loads(f.read())
 
             if not isinstance(data, list):
                 raise ValueError("JSON файл повинен містити список об'єктів.")
 
-            # Проста валідація структури точки
-            for point in data:
-                if not all(k in point for k in ["lat", "lon", "time"]):
-                    raise ValueError(f"Некоректна структура точки в JSON: {point}")
+            # Проста валідація структури точки: itemgetter перевіряє всі ключі одним проходом на рівні C
+            try:
+                list(map(operator.itemgetter("lat", "lon", "time"), data))
+            except (KeyError, TypeError):
+                # Повільний пошук першої некоректної точки лише для повідомлення про помилку
+                point = next(p for p in data if not isinstance(p, dict) or not all(k in p for k in ["lat", "lon", "time"]))
+                raise ValueError(f"Некоректна структура точки в JSON: {point}")
             return data
         except FileNotFoundError:
             raise IOError(f"Файл не знайдено: {json_path}")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise IOError(f"Не вдалося декодувати JSON з {json_path}. Помилка: {e}")
         except ValueError as e:
             raise IOError(f"Некоректні дані в {json_path}. Помилка: {e}")
@@ -78,7 +155,8 @@ void to_json(nlohmann::json& j, const Coordinate& c) {{
 Вимоги:
 1. Вхід: JSON масив з координатами (lat, lon у форматі *1е6, тобто цілі числа, які
 потрібно розділити на 10^6 для отримання десяткових градусів) та часом (timestamp,
-unixtime у секундах).
+unixtime у секундах). Шлях до вхідного JSON файлу передається першим аргументом
+командного рядка (`argv[1]`).
 2. Виявлення аномалій: точка вважається аномальною, якщо швидкість руху до/від цієї
 точки перевищує {ANOMALY_SPEED_THRESHOLD_M_PER_S} М/С Швидкість повинна
 розраховуватися між сусідніми точками.
@@ -89,6 +167,8 @@ unixtime у секундах).
 або видалити (обери безпечніший підхід).
 4. Вихід: JSON **об'єкт**, що обов'язково містить ключ "corrected_points" (масив виправлених точок)
 та ключі зі статистикою, наприклад, "anomalies_detected" та "anomalies_corrected".
+Вихідний JSON потрібно **записати у файл**, шлях до якого передається другим аргументом
+командного рядка (`argv[2]`), а не виводити у stdout.
    **Приклад ОБОВ'ЯЗКОВОГО формату вихідного JSON:**
    {{
      "corrected_points": [
@@ -108,8 +188,8 @@ unixtime у секундах).
     ```
     Це забезпечить доступність `M_PI` на різних платформах.
 * ** "Попередні версії коду часто мали помилки компіляції через відсутність #define _USE_MATH_DEFINES. Будь ласка, переконайся, що ти завжди його включаєш перед <cmath>."
-* **НІКОЛИ не включай функцію `main()`** у генерований C++ код. Твій код має бути бібліотекою функцій, що приймає та повертає JSON рядки.
-* **НІКОЛИ не вбудовуй приклади JSON даних** безпосередньо в C++ код (наприклад, використовуючи `R"([...)"`). Вхідні дані будуть надані через функцію.
+* **Обов'язково включи функцію `int main(int argc, char* argv[])`**, яка читає вхідний JSON з файлу `argv[1]`, обробляє його та записує вихідний JSON у файл `argv[2]`. Якщо аргументів недостатньо або файл не вдалося відкрити, виведи помилку в stderr та поверни ненульовий код.
+* **НІКОЛИ не вбудовуй приклади JSON даних** безпосередньо в C++ код (наприклад, використовуючи `R"([...)"`). Вхідні дані будуть надані лише через файл `argv[1]`.
 * При ітерації по `std::vector` використовуй `size_t` або `std::vector<ТвійТип>::size_type` для лічильників циклів, щоб уникнути попереджень про порівняння знакових/беззнакових типів. Наприклад: `for (size_t i = 0; i < vec.size(); ++i)`.
 * **Завжди огортай згенерований C++ код у блок markdown**, що починається з ````cpp` і закінчується ````. Жодного іншого тексту чи пояснень поза цим блоком бути не повинно.
 
@@ -123,6 +203,10 @@ unixtime у секундах).
 Якщо ти не можеш обійтися без сторонніх залежностей, вкажи це явно в коментарі на
 початку коду та надай інструкцію з встановлення.
 Використовуй формулу Гаверсина для розрахунку відстані між GPS координатами.
+Для продуктивності, попередньо обчисли `std::vector<double> lat_rad, lon_rad, sin_lat, cos_lat`
+одним проходом, та використовуй їх у циклі Гаверсина, щоб уникнути повторних викликів
+`std::sin/std::cos` для одних і тих самих широт. Структура `Coordinate` залишається для
+читання та запису JSON.
 Надай лише готовий С++ код у блоці markdown, без зайвих пояснень поза блоком коду.
 """
 
@@ -131,10 +215,17 @@ unixtime у секундах).
             {"role": "user", "content": base_prompt}
         ]
 
+        if self._best_successful_code:
+            messages.append({"role": "assistant", "content": f"```cpp\n{self._best_successful_code}\n```"})
+            messages.append({"role": "user", "content": "Цей код успішно пройшов усі тести. Покращи цей код по продуктивності, зберігаючи коректність та формат вхідних/вихідних даних."})
+
         if feedback:
-            messages.append({"role": "user", "content": f"Зворотний зв'язок:\n{feedback}\nБудь ласка, покращи код, приділяючи увагу продуктивності, коректності та обробці крайніх випадків (наприклад, аномалії, що йдуть поспіль, аномалії на початку/в кінці)."})
+            # Зворотний зв'язок стосується останньої спроби, яка може відрізнятися від показаного вище прикладу
+            feedback_title = "Зворотний зв'язок щодо попередньої спроби (не щодо наведеного вище коду)" if self._best_successful_code else "Зворотний зв'язок"
+            messages.append({"role": "user", "content": f"{feedback_title}:\n{feedback}\nБудь ласка, покращи код, приділяючи увагу продуктивності, коректності та обробці крайніх випадків (наприклад, аномалії, що йдуть поспіль, аномалії на початку/в кінці)."})
 
         try:
+            self.rate_limiter.acquire()
             response = self.client.chat.completions.create(
                 model=OPENAI_MODEL,
                 messages=messages,
@@ -156,21 +247,65 @@ unixtime у секундах).
         filename = os.path.join(OUTPUT_DIR, f"gps_algorithm_{iteration}.cpp")
         with open(filename, 'w', encoding='utf-8') as f:
             f.write(code)
-        self.cpp_code_history[iteration] = code # Зберігання коду для можливого фінального звіту
         return filename
 
-    def compile_cpp_code(self, cpp_file: str) -> bool:
-        """Компілює C++ код."""
+    def build_precompiled_header(self) -> Optional[str]:
+        """Один раз створює передкомпільований заголовок (PCH) для важких залежностей."""
+        if self._pch_attempted:
+            return self._pch_header
+        self._pch_attempted = True
+
+        pch_file = os.path.join(OUTPUT_DIR, CPP_PCH_HEADER)
+        with open(pch_file, 'w', encoding='utf-8') as f:
+            # _USE_MATH_DEFINES має стояти перед першим включенням <cmath>, інакше M_PI не буде доступним
+            f.write("#define _USE_MATH_DEFINES\n")
+            f.writelines(f"#include <{header}>\n" for header in CPP_PCH_INCLUDES)
+
         try:
-            # Додаємо прапорці для оптимізації та попереджень "-std=c++17" для сучасних стандартів C++
-            # "-O3" для максимальної оптимізації "-Wall -Wextra -pedantic" для включення всіх попереджень
+            # PCH використовується лише якщо зібраний з тими самими прапорцями, що й основний код
             subprocess.run(
-                [CPP_COMPILER, cpp_file, "-Iinclude", "-o", os.path.join(OUTPUT_DIR, CPP_OUTPUT_EXECUTABLE_NAME),
-                 "-std=c++17", "-O3", "-Wall", "-Wextra", "-pedantic"],
+                [CPP_COMPILER, "-x", "c++-header", pch_file, "-Iinclude", "-o", pch_file + ".gch", *CPP_FLAGS],
                 check=True,
                 stderr=subprocess.PIPE,
+                timeout=120
+            )
+            self._pch_header = pch_file
+        except subprocess.CalledProcessError as e:
+            print(f"Не вдалося створити передкомпільований заголовок, компіляція без нього:\n{e.stderr.decode('utf-8', errors='replace')}")
+        except Exception as e:
+            print(f"Не вдалося створити передкомпільований заголовок, компіляція без нього: {e}")
+        return self._pch_header
+
+    def compile_cpp_code(self, cpp_file: str, *, strict: bool = False) -> bool:
+        """Компілює C++ код (strict=True вмикає всі попередження та виводить їх)."""
+        try:
+            # Додаємо прапорці для оптимізації (CPP_FLAGS). Попередження ніхто не читає під час ітерацій,
+            # тому "-Wall -Wextra -pedantic" вмикаються лише для суворої перевірки
+            command = [CPP_COMPILER, cpp_file, "-Iinclude", "-o", os.path.join(OUTPUT_DIR, CPP_OUTPUT_EXECUTABLE_NAME),
+                       *CPP_FLAGS]
+            if strict:
+                command += ["-Wall", "-Wextra", "-pedantic"]
+            env = None
+
+            pch_file = self.build_precompiled_header()
+            if pch_file:
+                command += ["-include", pch_file]
+            if self.ccache:
+                # ccache пропускає компіляцію, якщо такий самий код уже компілювався
+                command.insert(0, self.ccache)
+                if pch_file:
+                    command.append("-fpch-preprocess")
+                    env = {**os.environ, "CCACHE_SLOPPINESS": "pch_defines,time_macros"} # Необхідно для кешування з PCH
+
+            result = subprocess.run(
+                command,
+                check=True,
+                stderr=subprocess.PIPE,
+                env=env,
                 timeout=60 # Збільшення таймауту для компіляції на випадок великого коду
             )
+            if strict and result.stderr:
+                print(f"Попередження компілятора:\n{result.stderr.decode('utf-8', errors='replace')}")
             return True
         except subprocess.CalledProcessError as e:
             print(f"Помилка компіляції:\n{e.stderr.decode('utf-8')}")
@@ -184,28 +319,44 @@ unixtime у секундах).
 
     def run_cpp_algorithm(self, input_file: str) -> Tuple[bool, float, Dict]:
         """Запускає скомпільований C++ код."""
-        start_time = time.time()
         try:
             # Створення унікального тимчасового файлу для виводу, щоб уникнути конфліктів
             output_json_path = os.path.join(OUTPUT_DIR, f"output_{os.path.basename(input_file)}.json")
 
-            # Передавання шляху до вхідного файлу як аргумент, чекаємо, що C++ код запише результат у файл або виведе в stdout.
-            result = subprocess.run(
-                [os.path.join(OUTPUT_DIR, CPP_OUTPUT_EXECUTABLE_NAME), input_file],
-                capture_output=True,
-                text=True,
+            # Видалення результату попередньої ітерації, щоб не прочитати застарілі дані
+            if os.path.exists(output_json_path):
+                os.remove(output_json_path)
+
+            # Тести однієї ітерації виконуються паралельно, тому це час роботи під спільним навантаженням:
+            # він придатний для порівняння ітерацій між собою, але не є ізольованим часом однієї програми
+            start_time = time.perf_counter()
+
+            # Передавання шляхів до вхідного та вихідного файлів як аргументів, C++ код записує результат у файл.
+            subprocess.run(
+                [os.path.join(OUTPUT_DIR, CPP_OUTPUT_EXECUTABLE_NAME), input_file, output_json_path],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
                 check=True,
                 timeout=60 # Збільшення таймауту для виконання
             )
-            execution_time = time.time() - start_time
-            output_data = json.loads(result.stdout)
+            execution_time = time.perf_counter() - start_time
+
+            if not os.path.exists(output_json_path):
+                print(f"C++ програма не створила вихідний файл: {output_json_path}")
+                return False, 0.0, {"error": "C++ program did not write the output JSON file"}
+
+            # Вивід залишається у байтах: orjson розбирає його без попереднього декодування
+            with open(output_json_path, 'rb') as f:
+                output_bytes = f.read()
+            output_data = orjson.loads(output_bytes)
             return True, execution_time, output_data
-        except json.JSONDecodeError:
-            print(f"Некоректний вивід JSON з C++ програми:\n{result.stdout}")
+        except orjson.JSONDecodeError:
+            print(f"Некоректний вивід JSON з C++ програми:\n{output_bytes.decode('utf-8', errors='replace')}")
             return False, 0.0, {"error": "Invalid JSON output from C++ program"}
         except subprocess.CalledProcessError as e:
-            print(f"Помилка виконання C++ програми (код повернення {e.returncode}):\n{e.stderr}")
-            return False, 0.0, {"error": f"Runtime error in C++ program: {e.stderr}"}
+            stderr = e.stderr.decode('utf-8', errors='replace')
+            print(f"Помилка виконання C++ програми (код повернення {e.returncode}):\n{stderr}")
+            return False, 0.0, {"error": f"Runtime error in C++ program: {stderr}"}
         except subprocess.TimeoutExpired:
             print("Перевищено таймаут виконання C++ програми.")
             return False, 0.0, {"error": "Timeout expired for C++ program"}
@@ -213,20 +364,20 @@ unixtime у секундах).
             print(f"Невідома помилка при запуску C++ програми: {e}")
             return False, 0.0, {"error": f"Unknown error during C++ program execution: {e}"}
 
-    def calculate_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        """Обчислює відстань між точками (формула Гаверсина)."""
+    def calculate_distance(self, lat1, lon1, lat2, lon2):
+        """Обчислює відстань між точками (формула Гаверсина); приймає як числа, так і масиви NumPy."""
         R = 6371000 # Радіус Землі в метрах
 
-        lat1_rad = math.radians(lat1)
-        lon1_rad = math.radians(lon1)
-        lat2_rad = math.radians(lat2)
-        lon2_rad = math.radians(lon2)
+        lat1_rad = np.radians(lat1)
+        lon1_rad = np.radians(lon1)
+        lat2_rad = np.radians(lat2)
+        lon2_rad = np.radians(lon2)
 
         dlon = lon2_rad - lon1_rad
         dlat = lat2_rad - lat1_rad
 
-        a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        a = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2)**2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
         return R * c
 
     def validate_results(self, original_data: List[Dict], processed_output: Dict) -> Tuple[bool, int, int, float, float, str]:
@@ -238,36 +389,35 @@ unixtime у секундах).
         if not corrected_data:
             return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, "Немає виправлених точок у виводі C++ програми."
 
-        speeds = []
+        # Перевірка швидкості у виправлених даних (векторизовано для всіх пар сусідніх точок)
+        try:
+            # Переконаємося, що lat/lon у виводі C++ також множить на 10^6, якщо AI їх не ділить
+            lat = _numeric_column(corrected_data, 'lat') / 1e6
+            lon = _numeric_column(corrected_data, 'lon') / 1e6
+            times = _numeric_column(corrected_data, 'time')
+        except KeyError as e:
+            return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, f"Відсутній ключ у даних виправлених точок: {e}"
+        except Exception as e:
+            return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, f"Помилка при валідації виправлених даних: {e}"
+
+        # Відстані між усіма парами сусідніх точок одним векторизованим викликом
+        distances = self.calculate_distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
 
-        # Перевірка швидкості у виправлених даних
-        for i in range(1, len(corrected_data)):
-            try:
-                prev = corrected_data[i-1]
-                curr = corrected_data[i]
-
-                # Переконаємося, що lat/lon у виводі C++ також множить на 10^6, якщо AI їх не ділить
-                lat1, lon1 = prev['lat'] / 1e6, prev['lon'] / 1e6
-                lat2, lon2 = curr['lat'] / 1e6, curr['lon'] / 1e6
-
-                time_diff = curr['time'] - prev['time']
-                if time_diff <= 0:
-                    continue
-
-                distance = self.calculate_distance(lat1, lon1, lat2, lon2)
-                speed = distance / time_diff
-                speeds.append(speed)
-
-                if speed > ANOMALY_SPEED_THRESHOLD_M_PER_S:
-                    # Якщо після виправлення все ще є аномальні швидкості
-                    return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, \
-                           f"Виявлено аномальну швидкість у виправлених даних: {speed:.2f} м/с між точками {i-1} та {i}."
-            except KeyError as e:
-                return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, f"Відсутній ключ у даних виправлених точок: {e}"
-            except Exception as e:
-                return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, f"Помилка при валідації виправлених даних: {e}"
-
-        if not speeds:
+        time_diffs = np.diff(times)
+        valid = time_diffs > 0 # Пари з неповторюваним, зростаючим часом
+        # Швидкість для кожної пари сусідніх точок (0 для пар без валідного інтервалу), індекс i відповідає точкам i та i+1
+        pair_speeds = np.divide(distances, time_diffs, out=np.zeros_like(distances), where=valid)
+
+        anomalous = pair_speeds > ANOMALY_SPEED_THRESHOLD_M_PER_S
+        if anomalous.any():
+            # Якщо після виправлення все ще є аномальні швидкості, повідомляємо про першу з них
+            i = int(anomalous.argmax())
+            return False, anomalies_detected, anomalies_corrected, 0.0, 0.0, \
+                   f"Виявлено аномальну швидкість у виправлених даних: {pair_speeds[i]:.2f} м/с між точками {i} та {i+1}."
+
+        speeds = pair_speeds[valid]
+
+        if speeds.size == 0:
             # Якщо після фільтрації немає даних для розрахунку швидкості, але точки є, це може бути ок.
             # Якщо points.json містить лише одну точку, speeds буде порожнім.
             if len(corrected_data) > 1:
@@ -275,9 +425,9 @@ unixtime у секундах).
             else:
                 return True, anomalies_detected, anomalies_corrected, 0.0, 0.0, "Менше двох точок для розрахунку швидкості."
 
-        avg_speed = statistics.mean(speeds)
-        median_speed = statistics.median(speeds)
-        max_speed = max(speeds)
+        avg_speed = float(speeds.mean())
+        median_speed = float(np.median(speeds)) # np.median використовує часткове сортування (partition)
+        max_speed = float(speeds.max())
 
         # Перевірка відхилення максимальної швидкості від середньої
         # Умова "не сильно відрізняється від максимальної" може бути інтерпретована як "максимальна швидкість не сильно перевищує середню"
@@ -304,12 +454,17 @@ unixtime у секундах).
             "error": ""
         }
         try:
-            original_data = self.load_json_data(file_path) # Використовуємо нову функцію
+            if file_path in self._file_cache:
+                # Тестові дані не змінюються між ітераціями, тому завантажуємо та записуємо їх лише один раз
+                original_data, input_json_path = self._file_cache[file_path]
+            else:
+                original_data = self.load_json_data(file_path) # Використовуємо нову функцію
 
-            # Зберігання вихідних даних у тимчасовий файл для передачі у C++ програму
-            input_json_path = os.path.join(OUTPUT_DIR, f"input_{os.path.basename(file_path)}")
-            with open(input_json_path, 'w', encoding='utf-8') as f:
-                json.dump(original_data, f, indent=2, ensure_ascii=False)
+                # Зберігання вихідних даних у тимчасовий файл для передачі у C++ програму
+                input_json_path = os.path.join(OUTPUT_DIR, f"input_{os.path.basename(file_path)}")
+                # Файл читає лише C++ програма, тому записуємо компактний JSON без відступів
+                _write_bytes_atomic(input_json_path, orjson.dumps(original_data))
+                self._file_cache[file_path] = (original_data, input_json_path)
 
             success, exec_time, output = self.run_cpp_algorithm(input_json_path)
             results["exec_time"] = exec_time
@@ -337,8 +492,8 @@ unixtime у секундах).
             results["error"] = f"Невідома помилка обробки тестового файлу: {e}"
             return results
 
-    def run_iteration(self, iteration: int, feedback: Optional[str] = None) -> Dict:
-        """Виконує одну ітерацію."""
+    def run_iteration(self, iteration: int, feedback: Optional[str] = None, cpp_code: Optional[str] = None) -> Dict:
+        """Виконує одну ітерацію (генерує код, якщо його не передано заздалегідь)."""
         iteration_summary = {
             "iteration": iteration,
             "compile_success": False,
@@ -346,18 +501,19 @@ unixtime у секундах).
             "overall_success": False,
             "avg_exec_time": 0.0,
             "feedback": "",
-            "cpp_code": "" # Додаємо для збереження коду в результати ітерації
+            "cpp_file": "" # Шлях до файлу з кодом ітерації (сам код не тримаємо в пам'яті)
         }
 
-        print(f"Генерація C++ коду для ітерації {iteration}...")
-        cpp_code = self.generate_cpp_code(feedback, iteration)
+        if cpp_code is None:
+            print(f"Генерація C++ коду для ітерації {iteration}...")
+            cpp_code = self.generate_cpp_code(feedback, iteration)
 
         if cpp_code == "ERROR_GENERATING_CODE":
             iteration_summary["feedback"] = "Помилка генерації коду AI. Перевірте ваш API ключ та доступ до моделі."
             return iteration_summary
 
-        iteration_summary["cpp_code"] = cpp_code # Зберігання згенерованого коду
         cpp_file = self.save_cpp_code(cpp_code, iteration)
+        iteration_summary["cpp_file"] = cpp_file
 
         print(f"Компіляція {cpp_file}...")
         compile_success = self.compile_cpp_code(cpp_file)
@@ -371,8 +527,11 @@ unixtime у секундах).
         all_tests_passed = True
         print("Запуск тестів...")
 
-        for test_file in TEST_FILES:
-            test_result = self.process_test_file(test_file, iteration)
+        # Кожен тест запускає окремий процес C++ з власними вхідним/вихідним файлами, тому тести виконуються паралельно
+        with ThreadPoolExecutor(max_workers=max(len(TEST_FILES), 1)) as executor:
+            test_results = list(executor.map(lambda f: self.process_test_file(f, iteration), TEST_FILES))
+
+        for test_file, test_result in zip(TEST_FILES, test_results):
             iteration_summary["test_results"].append(test_result)
             total_exec_time += test_result["exec_time"]
 
@@ -394,6 +553,20 @@ unixtime у секундах).
         print(f"Ітерація {iteration} завершена. Успіх: {all_tests_passed}. Середній час: {iteration_summary['avg_exec_time']:.4f} сек.")
         return iteration_summary
 
+    def make_report_entry(self, it: Dict) -> Dict:
+        """Формує запис звіту для однієї ітерації."""
+        return {
+            "iteration": it["iteration"],
+            "compile_success": it["compile_success"],
+            "overall_success": it["overall_success"],
+            "avg_exec_time": it["avg_exec_time"],
+            "feedback": it["feedback"],
+            "test_results_summary": [
+                {"test_file": tr["test_file"], "success": tr["success"], "exec_time": tr["exec_time"], "error": tr["error"]}
+                for tr in it["test_results"]
+            ]
+        }
+
     def generate_final_report(self):
         """Генерує фінальний звіт."""
         report = {
@@ -401,34 +574,20 @@ unixtime у секундах).
             "successful_iterations": sum(1 for it in self.iteration_results if it["overall_success"]),
             "best_iteration": None,
             "best_exec_time": float('inf'),
-            "iterations": []
+            "iterations": [self.make_report_entry(it) for it in self.iteration_results]
         }
-        best_cpp_code = ""
 
         for it in self.iteration_results:
-            report_entry = {
-                "iteration": it["iteration"],
-                "compile_success": it["compile_success"],
-                "overall_success": it["overall_success"],
-                "avg_exec_time": it["avg_exec_time"],
-                "feedback": it["feedback"],
-                "test_results_summary": [
-                    {"test_file": tr["test_file"], "success": tr["success"], "exec_time": tr["exec_time"], "error": tr["error"]}
-                    for tr in it["test_results"]
-                ]
-            }
-            report["iterations"].append(report_entry)
-
             if it["overall_success"] and it["avg_exec_time"] < report["best_exec_time"]:
                 report["best_iteration"] = it["iteration"]
                 report["best_exec_time"] = it["avg_exec_time"]
-                best_cpp_code = it["cpp_code"] # Зберігання коду найкращої ітерації
+                best_cpp_file = it["cpp_file"]
 
-        report["best_algorithm_code"] = best_cpp_code # Додавання найкращого коду у звіт
+        # Найкраща ітерація обирається за тим самим критерієм, що й приклад для генерації, тому її код уже в пам'яті
+        report["best_algorithm_code"] = self._best_successful_code or "" # Додавання найкращого коду у звіт
 
         report_file = os.path.join(OUTPUT_DIR, "final_report.json")
-        with open(report_file, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=2, ensure_ascii=False)
+        _write_bytes_atomic(report_file, orjson.dumps(report, option=orjson.OPT_INDENT_2)) # Звіт читає людина, тому з відступами
 
         print("\n=== Фінальний звіт ===")
         print(f"Всього ітерацій: {report['total_iterations']}")
@@ -437,6 +596,10 @@ unixtime у секундах).
         if report["best_iteration"] is not None:
             print(f"Найкраща ітерація (за середнім часом виконання): Ітерація {report['best_iteration']} із середнім часом {report['best_exec_time']:.4f} сек.")
             print(f"\nКод найкращого алгоритму збережено у '{OUTPUT_DIR}/gps_algorithm_{report['best_iteration']}.cpp' та включено до звіту.")
+
+            # Фінальна збірка найкращого коду з усіма попередженнями; виконуваний файл відповідатиме найкращій ітерації
+            print("Перекомпіляція найкращого алгоритму з усіма попередженнями...")
+            self.compile_cpp_code(best_cpp_file, strict=True)
         else:
             print("Не вдалося знайти ітерацій, що успішно пройшли всі тести.")
 
@@ -467,25 +630,58 @@ unixtime у секундах).
         successful_iterations_count = 0
         iteration_counter = 0 # Лічильник загальної кількості ітерацій
     
-        # Виконуємо цикл, поки не наберемо потрібну кількість успішних ітерацій
-        while successful_iterations_count < SUCCESS_ITERATIONS_TARGET:
-            iteration_counter += 1
-            print(f"\n--- Запуск ітерації {iteration_counter} (Ціль: {successful_iterations_count}/{SUCCESS_ITERATIONS_TARGET} успішних) ---")
-
-            # Запобіжник, щоб уникнути нескінченного циклу і зайвих витрат
-            if iteration_counter > 50: # Максимум 50 спроб
-                print("Перевищено максимальну кількість загальних ітерацій (50). Зупинка.")
-                break
-
-            iteration_result = self.run_iteration(iteration_counter - 1, feedback)
-            self.iteration_results.append(iteration_result)
-
-            if iteration_result["overall_success"]:
-                successful_iterations_count += 1
-                print(f"Ітерація успішна! Всього успішних: {successful_iterations_count}")
-        
-            feedback = iteration_result["feedback"] # Передаємо зворотний зв'язок для наступної ітерації
-            time.sleep(2) # Затримка, щоб уникнути лімітів API
+        # Журнал попереднього запуску (можливо, аварійно перерваного) архівується, а не перезаписується
+        iterations_log = os.path.join(OUTPUT_DIR, ITERATIONS_LOG_FILE)
+        if os.path.exists(iterations_log):
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(iterations_log)))
+            name, ext = os.path.splitext(ITERATIONS_LOG_FILE)
+            os.replace(iterations_log, os.path.join(OUTPUT_DIR, f"{name}_{stamp}{ext}"))
+
+        # Підсумок кожної ітерації записується одразу (без буферизації), щоб результати не втрачались у разі аварійного завершення.
+        # Генерація коду (запит до OpenAI) виконується у фоні, паралельно з компіляцією та тестами попередньої ітерації
+        with open(iterations_log, 'wb', buffering=0) as report_fp, ThreadPoolExecutor(max_workers=1) as executor:
+            next_code_future = None
+
+            # Виконуємо цикл, поки не наберемо потрібну кількість успішних ітерацій
+            while successful_iterations_count < SUCCESS_ITERATIONS_TARGET:
+                iteration_counter += 1
+                print(f"\n--- Запуск ітерації {iteration_counter} (Ціль: {successful_iterations_count}/{SUCCESS_ITERATIONS_TARGET} успішних) ---")
+
+                # Запобіжник, щоб уникнути нескінченного циклу і зайвих витрат
+                if iteration_counter > 50: # Максимум 50 спроб
+                    print("Перевищено максимальну кількість загальних ітерацій (50). Зупинка.")
+                    break
+
+                if next_code_future is not None:
+                    cpp_code = next_code_future.result()
+                else:
+                    # Код не генерувався у фоні (перша ітерація або попередня могла бути останньою)
+                    print(f"Генерація C++ коду для ітерації {iteration_counter - 1}...")
+                    cpp_code = self.generate_cpp_code(feedback, iteration_counter - 1)
+
+                # Код наступної ітерації генерується у фоні з останнім доступним зворотним зв'язком (відстає на одну ітерацію).
+                # Якщо поточна ітерація може виявитися останньою, платний запит не надсилається заздалегідь:
+                # вже запущений запит неможливо скасувати.
+                next_code_future = None
+                if iteration_counter < 50 and successful_iterations_count + 1 < SUCCESS_ITERATIONS_TARGET:
+                    print(f"Генерація C++ коду для ітерації {iteration_counter} (у фоні)...")
+                    next_code_future = executor.submit(self.generate_cpp_code, feedback, iteration_counter)
+
+                iteration_result = self.run_iteration(iteration_counter - 1, cpp_code=cpp_code)
+                self.iteration_results.append(iteration_result)
+                report_fp.write(orjson.dumps(self.make_report_entry(iteration_result)) + b"\n")
+
+                if iteration_result["overall_success"]:
+                    successful_iterations_count += 1
+                    print(f"Ітерація успішна! Всього успішних: {successful_iterations_count}")
+
+                    if iteration_result["avg_exec_time"] < self._best_successful_time:
+                        self._best_successful_code = cpp_code
+                        self._best_successful_time = iteration_result["avg_exec_time"]
+
+                feedback = iteration_result["feedback"] # Передаємо зворотний зв'язок для наступної ітерації
+
+        self.http_client.close()
 
         if successful_iterations_count >= SUCCESS_ITERATIONS_TARGET:
             print(f"\n🎉 Досягнуто цільової кількості ({SUCCESS_ITERATIONS_TARGET}) успішних ітерацій!")